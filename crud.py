@@ -1,12 +1,67 @@
+from sqlalchemy import Row, case, delete, exists, func, insert, select, update
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 import models, schemas
 from fastapi import HTTPException
 import logging
-from typing import List, Optional
+import threading
+from cachetools import TTLCache
+from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+# Cache em memória dos produtos buscados por ID, servido sem acesso ao banco.
+# Cada worker tem o seu e só ele é invalidado na escrita: nos demais, GET /produtos/{id}
+# pode ficar até 30s desatualizado. Pedidos sempre leem preço e estoque do banco
+_cache_produtos = TTLCache(maxsize=1024, ttl=30)
+_cache_lock = threading.Lock()
+
+# Incrementada a cada invalidação: uma leitura iniciada antes de uma escrita
+# não grava no cache o estado antigo depois que a escrita o invalidou
+_geracao_produtos = 0
+
+# Cache do relatório de produto mais vendido, por processo. As chaves incluem a geração
+# lida de controle_cache, incrementada por toda escrita de pedido em qualquer worker:
+# depois de uma escrita, as entradas antigas deixam de ser encontradas
+_cache_relatorios = TTLCache(maxsize=128, ttl=30)
+
+# Marca ausência no cache (None é um valor válido para o produto mais vendido)
+_AUSENTE = object()
+
+
+def _invalidar_cache_produtos(*produto_ids: int):
+    """
+    Remove do cache os produtos cujo estado foi alterado.
+    """
+    global _geracao_produtos
+    with _cache_lock:
+        _geracao_produtos += 1
+        for produto_id in produto_ids:
+            _cache_produtos.pop(produto_id, None)
+
+
+def _registrar_alteracao(db: Session):
+    """
+    Incrementa a geração de controle_cache dentro da transação de escrita de um pedido
+    (únicas escritas que alteram itens_pedido), invalidando o produto mais vendido em
+    cache de todos os workers no commit.
+    """
+    db.execute(
+        update(models.ControleCache)
+        .where(models.ControleCache.id == 1)
+        .values(geracao=models.ControleCache.geracao + 1)
+    )
+
+
+def _geracao_atual(db: Session) -> int:
+    """
+    Lê a geração atual de controle_cache (consulta pela PK).
+    """
+    return db.execute(
+        select(models.ControleCache.geracao).where(models.ControleCache.id == 1)
+    ).scalar()
+
 
 # === PRODUTOS ===
 
@@ -23,21 +78,9 @@ def criar_produto(db: Session, produto: schemas.ProdutoCreate):
         if produto.quantidade_estoque < 0:
             raise HTTPException(status_code=400, detail="Quantidade em estoque não pode ser negativa")
         
-        # Verificar se produto já existe (o unique constraint também fará isso)
-        produto_existente = db.query(models.Produto).filter(
-            models.Produto.nome == produto.nome.strip().title()
-        ).first()
-        
-        if produto_existente:
-            raise HTTPException(status_code=400, detail="Produto com este nome já existe")
-        
-        # Criar produto
-        produto_data = produto.dict()
-        produto_data['nome'] = produto_data['nome'].strip().title()
-        if produto_data.get('descricao'):
-            produto_data['descricao'] = produto_data['descricao'].strip()
-        
-        db_produto = models.Produto(**produto_data)
+        # Criar produto (nome duplicado é barrado pelo unique constraint no commit)
+        # Nome e descrição já chegam normalizados pelos validators do schema
+        db_produto = models.Produto(**produto.model_dump())
         db.add(db_produto)
         db.commit()
         db.refresh(db_produto)
@@ -64,12 +107,15 @@ def criar_produto(db: Session, produto: schemas.ProdutoCreate):
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
 
 
-def listar_produtos(db: Session, skip: int = 0, limit: int = 100):
+def listar_produtos(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
     """
-    Lista produtos com paginação.
+    Lista produtos com paginação. Com after_id, pagina por chave (id > after_id).
     """
     try:
-        return db.query(models.Produto).offset(skip).limit(limit).all()
+        query = select(models.Produto).order_by(models.Produto.id)
+        if after_id is not None:
+            query = query.where(models.Produto.id > after_id)
+        return db.execute(query.offset(skip).limit(limit)).scalars().all()
     except SQLAlchemyError as e:
         logger.error(f"Erro ao listar produtos: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
@@ -77,13 +123,26 @@ def listar_produtos(db: Session, skip: int = 0, limit: int = 100):
 
 def buscar_produto(db: Session, produto_id: int):
     """
-    Busca um produto específico por ID.
+    Busca um produto específico por ID, usando o cache em memória quando possível.
     """
+    with _cache_lock:
+        produto_cache = _cache_produtos.get(produto_id)
+        geracao = _geracao_produtos
+
+    if produto_cache is not None:
+        return produto_cache
+
     try:
-        produto = db.query(models.Produto).filter(models.Produto.id == produto_id).first()
+        produto = db.get(models.Produto, produto_id)
         if not produto:
             raise HTTPException(status_code=404, detail="Produto não encontrado")
-        return produto
+        
+        # Guarda uma cópia desacoplada da sessão, se nenhuma escrita invalidou o cache nesse meio tempo
+        produto_cache = schemas.Produto.model_validate(produto)
+        with _cache_lock:
+            if geracao == _geracao_produtos:
+                _cache_produtos[produto_id] = produto_cache
+        return produto_cache
     except HTTPException:
         raise
     except SQLAlchemyError as e:
@@ -96,10 +155,15 @@ def atualizar_produto(db: Session, produto_id: int, dados: schemas.ProdutoUpdate
     Atualiza um produto existente com validações e tratamento de erros.
     """
     try:
-        produto = db.query(models.Produto).filter(models.Produto.id == produto_id).first()
+        _iniciar_escrita(db)
+        
+        produto = db.get(models.Produto, produto_id)
         if not produto:
             raise HTTPException(status_code=404, detail="Produto não encontrado")
         
+        # Controle otimista: o cliente envia a versão que leu
+        _verificar_versao_produto(produto, dados.versao)
+        
         # Validações
         if dados.preco <= 0:
             raise HTTPException(status_code=400, detail="Preço deve ser maior que zero")
@@ -107,24 +171,14 @@ def atualizar_produto(db: Session, produto_id: int, dados: schemas.ProdutoUpdate
         if dados.quantidade_estoque < 0:
             raise HTTPException(status_code=400, detail="Quantidade em estoque não pode ser negativa")
         
-        # Verificar se nome já existe (exceto para o próprio produto)
-        nome_normalizado = dados.nome.strip().title()
-        if nome_normalizado != produto.nome:
-            produto_existente = db.query(models.Produto).filter(
-                models.Produto.nome == nome_normalizado,
-                models.Produto.id != produto_id
-            ).first()
-            
-            if produto_existente:
-                raise HTTPException(status_code=400, detail="Produto com este nome já existe")
-        
-        # Atualizar campos
-        produto.nome = nome_normalizado
-        produto.descricao = dados.descricao.strip() if dados.descricao else None
+        # Atualizar campos (nome duplicado é barrado pelo unique constraint no commit)
+        produto.nome = dados.nome
+        produto.descricao = dados.descricao or None
         produto.preco = dados.preco
         produto.quantidade_estoque = dados.quantidade_estoque
         
         db.commit()
+        _invalidar_cache_produtos(produto_id)
         db.refresh(produto)
         
         logger.info(f"Produto atualizado com sucesso: {produto.id} - {produto.nome}")
@@ -149,19 +203,23 @@ def atualizar_produto(db: Session, produto_id: int, dados: schemas.ProdutoUpdate
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
 
 
-def deletar_produto(db: Session, produto_id: int):
+def deletar_produto(db: Session, produto_id: int, versao: Optional[int] = None):
     """
     Deleta um produto se não estiver em nenhum pedido.
     """
     try:
-        produto = db.query(models.Produto).filter(models.Produto.id == produto_id).first()
+        _iniciar_escrita(db)
+        
+        produto = db.get(models.Produto, produto_id)
         if not produto:
             raise HTTPException(status_code=404, detail="Produto não encontrado")
         
+        _verificar_versao_produto(produto, versao)
+        
         # Verificar se produto está em pedidos
-        pedido_com_produto = db.query(models.ItemPedido).filter(
+        pedido_com_produto = db.query(exists().where(
             models.ItemPedido.produto_id == produto_id
-        ).first()
+        )).scalar()
         
         if pedido_com_produto:
             raise HTTPException(
@@ -172,6 +230,7 @@ def deletar_produto(db: Session, produto_id: int):
         nome_produto = produto.nome
         db.delete(produto)
         db.commit()
+        _invalidar_cache_produtos(produto_id)
         
         logger.info(f"Produto deletado com sucesso: {produto_id} - {nome_produto}")
         return {"mensagem": "Produto deletado com sucesso"}
@@ -196,26 +255,18 @@ def criar_pedido(db: Session, pedido: schemas.PedidoCreate):
     Cria um novo pedido com validações completas e controle de estoque.
     """
     try:
-        if not pedido.itens:
-            raise HTTPException(status_code=400, detail="Pedido deve conter pelo menos um item")
+        # Validações que não dependem do banco, antes de abrir a transação
+        produto_ids = _validar_itens_pedido(pedido.itens)
         
-        # Validar produtos duplicados
-        produto_ids = [item.produto_id for item in pedido.itens]
-        if len(produto_ids) != len(set(produto_ids)):
-            raise HTTPException(status_code=400, detail="Não é possível ter produtos duplicados no mesmo pedido")
+        _iniciar_escrita(db)
         
-        valor_total = 0
-        itens_pedido = []
-        produtos_para_atualizar = []
+        # Buscar todos os produtos do pedido em uma única consulta, bloqueando as linhas
+        # em ordem crescente de ID para evitar deadlock entre pedidos concorrentes
+        produtos = _buscar_produtos_pedido(db, produto_ids)
 
-        # Validar todos os itens antes de processar qualquer coisa
+        # Validar existência e estoque de todos os itens antes de processar qualquer coisa
         for item in pedido.itens:
-            if item.quantidade <= 0:
-                raise HTTPException(status_code=400, detail="Quantidade deve ser maior que zero")
-            
-            produto = db.query(models.Produto).filter(
-                models.Produto.id == item.produto_id
-            ).first()
+            produto = produtos.get(item.produto_id)
             
             if not produto:
                 raise HTTPException(
@@ -230,50 +281,40 @@ def criar_pedido(db: Session, pedido: schemas.PedidoCreate):
                           f"Disponível: {produto.quantidade_estoque}, Solicitado: {item.quantidade}"
                 )
 
-            total_item = item.quantidade * produto.preco
-            valor_total += total_item
-
-            itens_pedido.append({
-                'produto': produto,
-                'item': item,
-                'total_item': total_item
-            })
+        valor_total = sum(item.quantidade * produtos[item.produto_id].preco for item in pedido.itens)
 
         # Criar o pedido
-        cliente_normalizado = pedido.cliente.strip().title()
         db_pedido = models.Pedido(
-            cliente=cliente_normalizado, 
+            cliente=pedido.cliente, 
             valor_total=valor_total
         )
         db.add(db_pedido)
         db.flush()  # Para obter o ID do pedido sem fazer commit
 
-        # Criar os itens e atualizar estoque
-        for item_info in itens_pedido:
-            produto = item_info['produto']
-            item = item_info['item']
-            total_item = item_info['total_item']
-            
-            # Atualizar estoque
-            produto.quantidade_estoque -= item.quantidade
-            produtos_para_atualizar.append((produto.id, item.quantidade))
-            
-            # Criar item do pedido
-            item_pedido = models.ItemPedido(
-                pedido_id=db_pedido.id,
-                produto_id=produto.id,
-                nome_produto=produto.nome,
-                quantidade=item.quantidade,
-                preco_unitario=produto.preco,
-                valor_total_item=total_item
-            )
-            db.add(item_pedido)
+        # Criar os itens
+        itens_para_inserir = [
+            _montar_item_pedido(db_pedido.id, item, produtos[item.produto_id])
+            for item in pedido.itens
+        ]
+
+        # INSERT único com RETURNING: os itens voltam prontos, sem nova leitura após o commit
+        itens_criados = db.scalars(
+            insert(models.ItemPedido).returning(models.ItemPedido), itens_para_inserir
+        ).all()
+        set_committed_value(db_pedido, 'itens', itens_criados)
 
+        # Debitar estoque atomicamente; falha se outro pedido consumiu o estoque nesse meio tempo
+        if not _debitar_estoque(db, {item.produto_id: item.quantidade for item in pedido.itens}):
+            raise HTTPException(status_code=400, detail="Estoque insuficiente para um ou mais produtos do pedido")
+
+        # Resposta montada antes do commit, que expira os objetos da sessão
+        pedido_criado = schemas.Pedido.model_validate(db_pedido)
+        _registrar_alteracao(db)
         db.commit()
-        db.refresh(db_pedido)
+        _invalidar_cache_produtos(*produto_ids)
         
-        logger.info(f"Pedido criado com sucesso: {db_pedido.id} - Cliente: {db_pedido.cliente}")
-        return db_pedido
+        logger.info(f"Pedido criado com sucesso: {pedido_criado.id} - Cliente: {pedido_criado.cliente}")
+        return pedido_criado
         
     except HTTPException:
         db.rollback()
@@ -288,23 +329,52 @@ def criar_pedido(db: Session, pedido: schemas.PedidoCreate):
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
 
 
-def listar_pedidos(db: Session, skip: int = 0, limit: int = 100):
+def listar_pedidos(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
     """
-    Lista pedidos com paginação.
+    Lista pedidos com paginação. Com after_id, pagina por chave (id > after_id).
     """
     try:
-        return db.query(models.Pedido).offset(skip).limit(limit).all()
+        query = select(models.Pedido).order_by(models.Pedido.id)
+        if after_id is not None:
+            query = query.where(models.Pedido.id > after_id)
+        return db.execute(query.offset(skip).limit(limit)).scalars().all()
     except SQLAlchemyError as e:
         logger.error(f"Erro ao listar pedidos: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
 
 
+def listar_pedidos_resumo(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    """
+    Lista pedidos sem os itens, apenas com a quantidade de itens de cada um,
+    em uma única consulta agregada (sem carregar objetos do ORM).
+    """
+    try:
+        query = (
+            select(
+                models.Pedido.id,
+                models.Pedido.cliente,
+                models.Pedido.valor_total,
+                models.Pedido.data_pedido,
+                func.count(models.ItemPedido.id).label('quantidade_itens')
+            )
+            .outerjoin(models.ItemPedido, models.ItemPedido.pedido_id == models.Pedido.id)
+            .group_by(models.Pedido.id)
+            .order_by(models.Pedido.id)
+        )
+        if after_id is not None:
+            query = query.where(models.Pedido.id > after_id)
+        return db.execute(query.offset(skip).limit(limit)).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Erro ao listar resumo de pedidos: {str(e)}")
+        raise HTTPException(status_code=500, detail="Erro interno do servidor")
+
+
 def buscar_pedido(db: Session, pedido_id: int):
     """
     Busca um pedido específico por ID.
     """
     try:
-        pedido = db.query(models.Pedido).filter(models.Pedido.id == pedido_id).first()
+        pedido = db.get(models.Pedido, pedido_id)
         if not pedido:
             raise HTTPException(status_code=404, detail="Pedido não encontrado")
         return pedido
@@ -320,48 +390,33 @@ def atualizar_pedido(db: Session, pedido_id: int, dados: schemas.PedidoUpdate):
     Atualiza um pedido existente com controle completo de estoque.
     """
     try:
-        pedido = db.query(models.Pedido).filter(models.Pedido.id == pedido_id).first()
-        if not pedido:
-            raise HTTPException(status_code=404, detail="Pedido não encontrado")
-        
-        # Validações iniciais
-        if not dados.itens:
-            raise HTTPException(status_code=400, detail="Pedido deve conter pelo menos um item")
+        # Validações que não dependem do banco, antes de abrir a transação
+        produto_ids = _validar_itens_pedido(dados.itens)
         
-        # Validar produtos duplicados
-        produto_ids = [item.produto_id for item in dados.itens]
-        if len(produto_ids) != len(set(produto_ids)):
-            raise HTTPException(status_code=400, detail="Não é possível ter produtos duplicados no mesmo pedido")
+        _iniciar_escrita(db)
         
-        # Armazenar estado anterior para possível rollback
-        itens_antigos = []
-        for item in pedido.itens:
-            produto = db.query(models.Produto).filter(
-                models.Produto.id == item.produto_id
-            ).first()
-            if produto:
-                itens_antigos.append((produto, item.quantidade))
+        pedido = db.get(models.Pedido, pedido_id)
+        if not pedido:
+            raise HTTPException(status_code=404, detail="Pedido não encontrado")
         
-        # Reverter estoque dos itens antigos
-        for produto, quantidade in itens_antigos:
-            produto.quantidade_estoque += quantidade
+        # Reverter estoque dos itens antigos (desfeito pelo rollback em caso de erro)
+        produto_ids_antigos = [item.produto_id for item in pedido.itens]
+        _repor_estoque(db, {item.produto_id: item.quantidade for item in pedido.itens})
         
-        # Remover itens antigos
-        db.query(models.ItemPedido).filter(
-            models.ItemPedido.pedido_id == pedido_id
-        ).delete()
+        # Remover itens antigos (a coleção é substituída abaixo pelos itens novos)
+        db.execute(
+            delete(models.ItemPedido)
+            .where(models.ItemPedido.pedido_id == pedido_id)
+            .execution_options(synchronize_session=False)
+        )
         
         # Validar e processar novos itens
-        valor_total = 0
-        itens_pedido = []
+        # Buscar todos os produtos novos em uma única consulta, bloqueando as linhas em ordem de ID
+        # (o estoque lido já inclui a reversão acima)
+        produtos = _buscar_produtos_pedido(db, produto_ids)
 
         for item in dados.itens:
-            if item.quantidade <= 0:
-                raise HTTPException(status_code=400, detail="Quantidade deve ser maior que zero")
-            
-            produto = db.query(models.Produto).filter(
-                models.Produto.id == item.produto_id
-            ).first()
+            produto = produtos.get(item.produto_id)
             
             if not produto:
                 raise HTTPException(
@@ -376,42 +431,37 @@ def atualizar_pedido(db: Session, pedido_id: int, dados: schemas.PedidoUpdate):
                           f"Disponível: {produto.quantidade_estoque}, Solicitado: {item.quantidade}"
                 )
 
-            total_item = item.quantidade * produto.preco
-            valor_total += total_item
-
-            itens_pedido.append({
-                'produto': produto,
-                'item': item,
-                'total_item': total_item
-            })
-
         # Atualizar dados do pedido
-        pedido.cliente = dados.cliente.strip().title()
-        pedido.valor_total = valor_total
-
-        # Criar novos itens e atualizar estoque
-        for item_info in itens_pedido:
-            produto = item_info['produto']
-            item = item_info['item']
-            total_item = item_info['total_item']
-            
-            produto.quantidade_estoque -= item.quantidade
-            
-            item_pedido = models.ItemPedido(
-                pedido_id=pedido.id,
-                produto_id=produto.id,
-                nome_produto=produto.nome,
-                quantidade=item.quantidade,
-                preco_unitario=produto.preco,
-                valor_total_item=total_item
-            )
-            db.add(item_pedido)
+        pedido.cliente = dados.cliente
+        pedido.valor_total = sum(item.quantidade * produtos[item.produto_id].preco for item in dados.itens)
+
+        # Criar novos itens
+        itens_para_inserir = [
+            _montar_item_pedido(pedido.id, item, produtos[item.produto_id])
+            for item in dados.itens
+        ]
+
+        # INSERT único com RETURNING, como em criar_pedido: sem nova leitura após o commit.
+        # populate_existing: o SQLite pode reaproveitar o ID de um item antigo ainda no
+        # identity map, que precisa receber os valores novos
+        itens_criados = db.scalars(
+            insert(models.ItemPedido).returning(models.ItemPedido), itens_para_inserir,
+            execution_options={"populate_existing": True}
+        ).all()
+        set_committed_value(pedido, 'itens', itens_criados)
 
+        # Debitar estoque dos novos itens atomicamente
+        if not _debitar_estoque(db, {item.produto_id: item.quantidade for item in dados.itens}):
+            raise HTTPException(status_code=400, detail="Estoque insuficiente para um ou mais produtos do pedido")
+
+        # Resposta montada antes do commit, que expira os objetos da sessão
+        pedido_atualizado = schemas.Pedido.model_validate(pedido)
+        _registrar_alteracao(db)
         db.commit()
-        db.refresh(pedido)
+        _invalidar_cache_produtos(*produto_ids, *produto_ids_antigos)
         
-        logger.info(f"Pedido atualizado com sucesso: {pedido.id} - Cliente: {pedido.cliente}")
-        return pedido
+        logger.info(f"Pedido atualizado com sucesso: {pedido_atualizado.id} - Cliente: {pedido_atualizado.cliente}")
+        return pedido_atualizado
         
     except HTTPException:
         db.rollback()
@@ -431,28 +481,27 @@ def deletar_pedido(db: Session, pedido_id: int):
     Deleta um pedido e reverte o estoque.
     """
     try:
-        pedido = db.query(models.Pedido).filter(models.Pedido.id == pedido_id).first()
+        _iniciar_escrita(db)
+        
+        pedido = db.get(models.Pedido, pedido_id)
         if not pedido:
             raise HTTPException(status_code=404, detail="Pedido não encontrado")
         
         cliente_pedido = pedido.cliente
+        produto_ids = [item.produto_id for item in pedido.itens]
         
         # Reverter estoque
-        for item in pedido.itens:
-            produto = db.query(models.Produto).filter(
-                models.Produto.id == item.produto_id
-            ).first()
-            if produto:
-                produto.quantidade_estoque += item.quantidade
-        
-        # Deletar itens do pedido (cascade deve fazer isso automaticamente)
-        db.query(models.ItemPedido).filter(
-            models.ItemPedido.pedido_id == pedido_id
-        ).delete()
-        
-        # Deletar pedido
-        db.delete(pedido)
+        _repor_estoque(db, {item.produto_id: item.quantidade for item in pedido.itens})
+        
+        # DELETE único do pedido; os itens são removidos pelo ON DELETE CASCADE do banco
+        db.execute(
+            delete(models.Pedido)
+            .where(models.Pedido.id == pedido_id)
+            .execution_options(synchronize_session=False)
+        )
+        _registrar_alteracao(db)
         db.commit()
+        _invalidar_cache_produtos(*produto_ids)
         
         logger.info(f"Pedido deletado com sucesso: {pedido_id} - Cliente: {cliente_pedido}")
         return {"mensagem": "Pedido deletado com sucesso"}
@@ -472,11 +521,121 @@ def deletar_pedido(db: Session, pedido_id: int):
 
 # === FUNÇÕES AUXILIARES ===
 
+def _verificar_versao_produto(produto: models.Produto, versao: Optional[int]):
+    """
+    Compara a versão informada pelo cliente com a atual; 409 se o produto mudou
+    (edição ou movimentação de estoque) desde a leitura do cliente.
+    """
+    if versao is not None and versao != produto.versao:
+        logger.warning(f"Conflito de versão no produto {produto.id}: informada {versao}, atual {produto.versao}")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Produto foi alterado por outra operação (versão atual: {produto.versao}). Tente novamente"
+        )
+
+
+def _validar_itens_pedido(itens: List[schemas.ItemPedidoCreate]) -> List[int]:
+    """
+    Valida os itens do pedido em memória e retorna os IDs dos produtos.
+    """
+    if not itens:
+        raise HTTPException(status_code=400, detail="Pedido deve conter pelo menos um item")
+    
+    if any(item.quantidade <= 0 for item in itens):
+        raise HTTPException(status_code=400, detail="Quantidade deve ser maior que zero")
+    
+    produto_ids = [item.produto_id for item in itens]
+    if len(produto_ids) != len(set(produto_ids)):
+        raise HTTPException(status_code=400, detail="Não é possível ter produtos duplicados no mesmo pedido")
+    
+    return produto_ids
+
+
+def _iniciar_escrita(db: Session):
+    """
+    Abre a transação com BEGIN IMMEDIATE, reservando o lock de escrita do SQLite
+    antes da leitura que precede a escrita.
+    """
+    db.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
+
+
+def _buscar_produtos_pedido(db: Session, produto_ids: List[int]) -> Dict[int, Row]:
+    """
+    Lê apenas as colunas usadas na validação do pedido, como linhas simples
+    (sem instanciar objetos do ORM), bloqueadas em ordem crescente de ID.
+    """
+    linhas = db.execute(
+        select(
+            models.Produto.id,
+            models.Produto.nome,
+            models.Produto.preco,
+            models.Produto.quantidade_estoque
+        )
+        .where(models.Produto.id.in_(produto_ids))
+        .order_by(models.Produto.id)
+        .with_for_update()
+    ).all()
+    return {linha.id: linha for linha in linhas}
+
+
+def _montar_item_pedido(pedido_id: int, item: schemas.ItemPedidoCreate, produto: Row) -> dict:
+    """
+    Monta a linha de ItemPedido para inserção em lote.
+    """
+    return {
+        'pedido_id': pedido_id,
+        'produto_id': produto.id,
+        'nome_produto': produto.nome,
+        'quantidade': item.quantidade,
+        'preco_unitario': produto.preco,
+        'valor_total_item': item.quantidade * produto.preco
+    }
+
+
+def _debitar_estoque(db: Session, quantidades: Dict[int, int]) -> bool:
+    """
+    Debita o estoque de vários produtos em um único UPDATE atômico.
+    Retorna False se algum produto não tiver estoque suficiente no momento do UPDATE.
+    """
+    quantidade = case(quantidades, value=models.Produto.id)
+    resultado = db.execute(
+        update(models.Produto)
+        .where(
+            models.Produto.id.in_(quantidades),
+            models.Produto.quantidade_estoque >= quantidade
+        )
+        .values(
+            quantidade_estoque=models.Produto.quantidade_estoque - quantidade,
+            versao=models.Produto.versao + 1
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount == len(quantidades)
+
+
+def _repor_estoque(db: Session, quantidades: Dict[int, int]):
+    """
+    Devolve ao estoque as quantidades de vários produtos em um único UPDATE atômico.
+    """
+    if not quantidades:
+        return
+    quantidade = case(quantidades, value=models.Produto.id)
+    db.execute(
+        update(models.Produto)
+        .where(models.Produto.id.in_(quantidades))
+        .values(
+            quantidade_estoque=models.Produto.quantidade_estoque + quantidade,
+            versao=models.Produto.versao + 1
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
 def verificar_estoque_produto(db: Session, produto_id: int, quantidade: int) -> bool:
     """
     Verifica se há estoque suficiente para um produto.
     """
-    produto = db.query(models.Produto).filter(models.Produto.id == produto_id).first()
+    produto = db.get(models.Produto, produto_id)
     if not produto:
         return False
     return produto.quantidade_estoque >= quantidade
@@ -485,11 +644,14 @@ def verificar_estoque_produto(db: Session, produto_id: int, quantidade: int) ->
 def obter_produtos_baixo_estoque(db: Session, limite: int = 10) -> List[models.Produto]:
     """
     Retorna produtos com estoque abaixo do limite.
+    
+    Sem cache: a consulta é uma faixa no índice idx_produto_estoque, e o resultado muda
+    com qualquer escrita de produto ou pedido.
     """
     try:
-        return db.query(models.Produto).filter(
-            models.Produto.quantidade_estoque <= limite
-        ).all()
+        return db.execute(
+            select(models.Produto).where(models.Produto.quantidade_estoque <= limite)
+        ).scalars().all()
     except SQLAlchemyError as e:
         logger.error(f"Erro ao buscar produtos com baixo estoque: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
@@ -500,36 +662,57 @@ def calcular_estatisticas(db: Session) -> dict:
     Calcula estatísticas gerais do sistema.
     """
     try:
-        total_produtos = db.query(models.Produto).count()
-        total_pedidos = db.query(models.Pedido).count()
-        
-        # Valor total dos pedidos
-        pedidos = db.query(models.Pedido).all()
-        valor_total = sum(pedido.valor_total for pedido in pedidos)
-        
-        # Produto mais vendido
-        produto_mais_vendido = db.query(
-            models.ItemPedido.produto_id,
-            models.ItemPedido.nome_produto,
-            db.func.sum(models.ItemPedido.quantidade).label('total_vendido')
-        ).group_by(
-            models.ItemPedido.produto_id,
-            models.ItemPedido.nome_produto
-        ).order_by(
-            db.func.sum(models.ItemPedido.quantidade).desc()
-        ).first()
+        # Contagens e valor total em uma única ida ao banco (subconsultas escalares)
+        total_produtos, total_pedidos, valor_total = db.execute(
+            select(
+                select(func.count()).select_from(models.Produto).scalar_subquery(),
+                select(func.count()).select_from(models.Pedido).scalar_subquery(),
+                select(func.coalesce(func.sum(models.Pedido.valor_total), 0.0)).scalar_subquery()
+            )
+        ).one()
         
         return {
             "total_produtos": total_produtos,
             "total_pedidos": total_pedidos,
             "valor_total_pedidos": valor_total,
             "ticket_medio": valor_total / total_pedidos if total_pedidos > 0 else 0,
-            "produto_mais_vendido": {
-                "id": produto_mais_vendido.produto_id if produto_mais_vendido else None,
-                "nome": produto_mais_vendido.nome_produto if produto_mais_vendido else None,
-                "quantidade_vendida": produto_mais_vendido.total_vendido if produto_mais_vendido else 0
-            } if produto_mais_vendido else None
+            "produto_mais_vendido": _produto_mais_vendido(db)
         }
     except SQLAlchemyError as e:
         logger.error(f"Erro ao calcular estatísticas: {str(e)}")
-        raise HTTPException(status_code=500, detail="Erro interno do servidor")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Erro interno do servidor")
+
+
+def _produto_mais_vendido(db: Session) -> Optional[dict]:
+    """
+    Agrega as vendas por produto (GROUP BY em itens_pedido), com cache até a
+    próxima escrita, por no máximo 30s.
+    """
+    chave = ("mais_vendido", _geracao_atual(db))
+    # Uma única consulta ao cache: entre um "in" e o acesso por chave a entrada pode expirar
+    with _cache_lock:
+        resultado = _cache_relatorios.get(chave, _AUSENTE)
+    if resultado is not _AUSENTE:
+        return resultado
+    
+    total_vendido = func.sum(models.ItemPedido.quantidade)
+    mais_vendido = db.execute(
+        select(
+            models.ItemPedido.produto_id,
+            models.ItemPedido.nome_produto,
+            total_vendido.label('total_vendido')
+        ).group_by(
+            models.ItemPedido.produto_id,
+            models.ItemPedido.nome_produto
+        ).order_by(total_vendido.desc()).limit(1)
+    ).first()
+    
+    resultado = {
+        "id": mais_vendido.produto_id,
+        "nome": mais_vendido.nome_produto,
+        "quantidade_vendida": mais_vendido.total_vendido
+    } if mais_vendido else None
+    
+    with _cache_lock:
+        _cache_relatorios[chave] = resultado
+    return resultado
\ No newline at end of file
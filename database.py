@@ -1,7 +1,8 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 
 # Pega o caminho absoluto do diretório onde este arquivo (database.py) está
@@ -16,11 +17,42 @@ caminho_banco = os.path.join(diretorio_atual, NOME_BANCO)
 # URL do banco de dados SQLite usando o caminho absoluto
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{caminho_banco}"
 
-# Conexão com o SQLite
+# Conexão com o SQLite usando um pool dimensionado, reaproveitando as conexões entre requisições.
+# LIFO devolve sempre as conexões usadas mais recentemente, cujo cache de páginas já está aquecido
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_timeout=30,
+    pool_use_lifo=True,
+    query_cache_size=1200,
+    connect_args={"check_same_thread": False, "timeout": 30},
 )
 
+# Ajustes do SQLite aplicados a cada nova conexão:
+# WAL permite leitores concorrentes com um escritor e reduz os fsyncs por commit
+@event.listens_for(engine, "connect")
+def configurar_sqlite(dbapi_connection, connection_record):
+    # Desliga o BEGIN implícito do driver; as transações são abertas em iniciar_transacao
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+# Abre as transações explicitamente. Quem vai escrever pode pedir
+# execution_options(sqlite_begin="IMMEDIATE") para reservar o lock de escrita
+# já no BEGIN, em vez de disputá-lo no meio da transação
+@event.listens_for(engine, "begin")
+def iniciar_transacao(conn):
+    modo = conn.get_execution_options().get("sqlite_begin", "DEFERRED")
+    conn.exec_driver_sql(f"BEGIN {modo}")
+
 # Criando uma sessão para conectar com o banco
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
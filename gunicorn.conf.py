@@ -0,0 +1,17 @@
+import multiprocessing
+
+# Configuração do Gunicorn para produção: gunicorn main:app -c gunicorn.conf.py
+bind = "0.0.0.0:8000"
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = "uvicorn_worker.UvicornWorker"
+loglevel = "warning"
+
+# Importa a aplicação uma única vez no processo mestre, evitando que os
+# workers disputem a criação das tabelas na primeira inicialização
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Cada worker abre suas próprias conexões em vez de herdar as do mestre
+    from database import engine
+    engine.dispose(close=False)
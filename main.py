@@ -1,16 +1,19 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, timezone
 import logging
+import time
 
 import models, schemas, crud
 from database import SessionLocal, engine
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
+# Configurar logging (WARNING: log por requisição custa throughput)
+logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Criar tabelas
@@ -32,15 +35,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Comprimir respostas grandes (listagens de pedidos com itens)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Dependency para obter sessão do banco
-def get_db():
+# Async: criar a Session não faz I/O (a conexão só é aberta na primeira consulta),
+# então a abertura roda no event loop sem passar pelo threadpool; só o close,
+# que devolve a conexão ao pool, vai para uma thread
+async def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await run_in_threadpool(db.close)
+
+# Paginação por chave: com a página cheia, o último ID vai no header X-Next-Cursor
+# para ser enviado como after_id na próxima requisição. Só sem skip: o cursor já
+# marca a posição, e repetir o skip junto com ele pularia registros
+def _definir_proximo_cursor(response: Response, registros: list, skip: int, limit: int):
+    if skip == 0 and len(registros) == limit:
+        response.headers["X-Next-Cursor"] = str(registros[-1].id)
+    return registros
 
 # Exception handler personalizado
 @app.exception_handler(HTTPException)
@@ -60,20 +78,31 @@ async def general_exception_handler(request, exc):
 
 # === ENDPOINTS ROOT ===
 
+# Endpoints sem acesso ao banco são async: rodam no event loop, sem ocupar o threadpool
+
 @app.get("/", tags=["Root"])
-def root():
+async def root():
     return {
         "mensagem": "API de Gestão de Estoque e Pedidos",
         "versao": "1.0.0",
         "docs": "/docs"
     }
 
+# Timestamp do health check em UTC, formatado no máximo uma vez por segundo
+_health_segundo = 0
+_health_timestamp = ""
+
+def _timestamp_health() -> str:
+    global _health_segundo, _health_timestamp
+    agora = int(time.time())
+    if agora != _health_segundo:
+        _health_segundo = agora
+        _health_timestamp = datetime.fromtimestamp(agora, timezone.utc).isoformat()
+    return _health_timestamp
+
 @app.get("/health", tags=["Health"])
-def health_check():
-    # Gera o timestamp no momento exato da requisição, no padrão UTC
-    timestamp_atual = datetime.now(timezone.utc).isoformat()
-    
-    return {"status": "OK", "timestamp": timestamp_atual}
+async def health_check():
+    return {"status": "OK", "timestamp": _timestamp_health()}
 
 # === ENDPOINTS PRODUTOS ===
 
@@ -91,14 +120,21 @@ def criar_produto(produto: schemas.ProdutoCreate, db: Session = Depends(get_db))
 
 @app.get("/produtos", response_model=List[schemas.Produto], tags=["Produtos"])
 def listar_produtos(
+    response: Response,
     skip: int = Query(0, ge=0, description="Número de registros para pular"),
     limit: int = Query(100, ge=1, le=1000, description="Limite de registros"),
+    after_id: Optional[int] = Query(None, ge=0, description="Retornar apenas registros com ID maior que este (paginação por chave)"),
     db: Session = Depends(get_db)
 ):
     """
     Listar todos os produtos com paginação
+    
+    Para páginas profundas, prefira **after_id** em vez de **skip**: quando a página vem
+    cheia e **skip** não foi usado, o header **X-Next-Cursor** traz o valor de after_id
+    da próxima página.
     """
-    return crud.listar_produtos(db, skip=skip, limit=limit)
+    produtos = crud.listar_produtos(db, skip=skip, limit=limit, after_id=after_id)
+    return _definir_proximo_cursor(response, produtos, skip, limit)
 
 @app.get("/produtos/{produto_id}", response_model=schemas.Produto, tags=["Produtos"])
 def obter_produto(produto_id: int, db: Session = Depends(get_db)):
@@ -115,15 +151,22 @@ def atualizar_produto(
 ):
     """
     Atualizar produto existente
+    
+    - **versao**: versão recebida no GET (opcional); se o produto foi alterado desde então
+      (inclusive por movimentação de estoque), retorna 409 em vez de sobrescrever
     """
     return crud.atualizar_produto(db, produto_id, dados)
 
 @app.delete("/produtos/{produto_id}", response_model=schemas.MensagemResponse, tags=["Produtos"])
-def deletar_produto(produto_id: int, db: Session = Depends(get_db)):
+def deletar_produto(
+    produto_id: int,
+    versao: Optional[int] = Query(None, ge=1, description="Versão lida do produto (retorna 409 se o produto mudou)"),
+    db: Session = Depends(get_db)
+):
     """
     Deletar produto (apenas se não estiver em nenhum pedido)
     """
-    return crud.deletar_produto(db, produto_id)
+    return crud.deletar_produto(db, produto_id, versao)
 
 # === ENDPOINTS PEDIDOS ===
 
@@ -144,14 +187,38 @@ def criar_pedido(pedido: schemas.PedidoCreate, db: Session = Depends(get_db)):
 
 @app.get("/pedidos", response_model=List[schemas.Pedido], tags=["Pedidos"])
 def listar_pedidos(
+    response: Response,
     skip: int = Query(0, ge=0, description="Número de registros para pular"),
     limit: int = Query(100, ge=1, le=1000, description="Limite de registros"),
+    after_id: Optional[int] = Query(None, ge=0, description="Retornar apenas registros com ID maior que este (paginação por chave)"),
     db: Session = Depends(get_db)
 ):
     """
     Listar todos os pedidos com paginação
+    
+    Para páginas profundas, prefira **after_id** em vez de **skip**: quando a página vem
+    cheia e **skip** não foi usado, o header **X-Next-Cursor** traz o valor de after_id
+    da próxima página.
     """
-    return crud.listar_pedidos(db, skip=skip, limit=limit)
+    pedidos = crud.listar_pedidos(db, skip=skip, limit=limit, after_id=after_id)
+    return _definir_proximo_cursor(response, pedidos, skip, limit)
+
+@app.get("/pedidos/resumo", response_model=List[schemas.PedidoResumo], tags=["Pedidos"])
+def listar_pedidos_resumo(
+    response: Response,
+    skip: int = Query(0, ge=0, description="Número de registros para pular"),
+    limit: int = Query(100, ge=1, le=1000, description="Limite de registros"),
+    after_id: Optional[int] = Query(None, ge=0, description="Retornar apenas registros com ID maior que este (paginação por chave)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Listar pedidos sem os itens, apenas com a quantidade de itens de cada um
+    
+    Mais leve que **GET /pedidos** para telas de listagem. Paginação por **after_id**
+    e header **X-Next-Cursor** (apenas sem **skip**), como em **GET /pedidos**.
+    """
+    pedidos = crud.listar_pedidos_resumo(db, skip=skip, limit=limit, after_id=after_id)
+    return _definir_proximo_cursor(response, pedidos, skip, limit)
 
 @app.get("/pedidos/{pedido_id}", response_model=schemas.Pedido, tags=["Pedidos"])
 def obter_pedido(pedido_id: int, db: Session = Depends(get_db)):
@@ -190,28 +257,14 @@ def produtos_baixo_estoque(limite: int = 10, db: Session = Depends(get_db)):
     """
     Listar produtos com estoque abaixo do limite especificado
     """
-    produtos = db.query(models.Produto).filter(
-        models.Produto.quantidade_estoque <= limite
-    ).all()
-    return produtos
+    return crud.obter_produtos_baixo_estoque(db, limite)
 
-@app.get("/estatisticas", tags=["Relatórios"])
+@app.get("/estatisticas", response_model=schemas.EstatisticasResponse, tags=["Relatórios"])
 def estatisticas(db: Session = Depends(get_db)):
     """
     Estatísticas gerais do sistema
     """
-    total_produtos = db.query(models.Produto).count()
-    total_pedidos = db.query(models.Pedido).count()
-    valor_total_pedidos = db.query(models.Pedido).all()
-    
-    valor_total = sum(pedido.valor_total for pedido in valor_total_pedidos)
-    
-    return {
-        "total_produtos": total_produtos,
-        "total_pedidos": total_pedidos,
-        "valor_total_pedidos": valor_total,
-        "ticket_medio": valor_total / total_pedidos if total_pedidos > 0 else 0
-    }
+    return crud.calcular_estatisticas(db)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index, DDL, event, func
+from sqlalchemy.orm import relationship, validates
 from datetime import datetime
 
 from database import Base
@@ -12,8 +12,13 @@ class Produto(Base):
     descricao = Column(String, nullable=True)
     preco = Column(Float, nullable=False)
     quantidade_estoque = Column(Integer, nullable=False, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=datetime.utcnow, nullable=False)
+    versao = Column(Integer, nullable=False)
+    
+    # Controle otimista de concorrência: incrementada a cada escrita (inclusive de estoque)
+    # e exposta na API; PUT/DELETE com uma versão antiga retornam 409
+    __mapper_args__ = {"version_id_col": versao}
     
     # Relacionamento explícito com back_populates
     itens_pedido = relationship("ItemPedido", back_populates="produto")
@@ -28,12 +33,21 @@ class Pedido(Base):
     id = Column(Integer, primary_key=True, index=True)
     cliente = Column(String, nullable=False, index=True)
     valor_total = Column(Float, nullable=False)
-    data_pedido = Column(DateTime, default=datetime.utcnow, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    data_pedido = Column(DateTime, server_default=func.now(), nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=datetime.utcnow, nullable=False)
     
     # Relacionamento explícito com back_populates e cascade
-    itens = relationship("ItemPedido", back_populates="pedido", cascade="all, delete-orphan")
+    # selectin: os itens sempre acompanham o pedido na resposta, carregados em uma única consulta IN
+    itens = relationship(
+        "ItemPedido", back_populates="pedido", cascade="all, delete-orphan",
+        lazy="selectin", passive_deletes=True
+    )
+
+    @validates("cliente")
+    def normalizar_cliente(self, key, cliente):
+        # Normalização do nome do cliente em um único ponto, a cada atribuição
+        return cliente.strip().title()
 
     def __repr__(self):
         return f"<Pedido(id={self.id}, cliente='{self.cliente}', valor_total={self.valor_total})>"
@@ -43,13 +57,13 @@ class ItemPedido(Base):
     __tablename__ = "itens_pedido"
 
     id = Column(Integer, primary_key=True, index=True)
-    pedido_id = Column(Integer, ForeignKey("pedidos.id"), nullable=False)
-    produto_id = Column(Integer, ForeignKey("produtos.id"), nullable=False)
+    pedido_id = Column(Integer, ForeignKey("pedidos.id", ondelete="CASCADE"), nullable=False)
+    produto_id = Column(Integer, ForeignKey("produtos.id"), nullable=False, index=True)
     nome_produto = Column(String, nullable=False)
     quantidade = Column(Integer, nullable=False)
     preco_unitario = Column(Float, nullable=False)
     valor_total_item = Column(Float, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
     
     # Relacionamentos explícitos com back_populates
     pedido = relationship("Pedido", back_populates="itens")
@@ -59,6 +73,25 @@ class ItemPedido(Base):
         return f"<ItemPedido(id={self.id}, pedido_id={self.pedido_id}, produto_id={self.produto_id}, quantidade={self.quantidade})>"
 
 
+class ControleCache(Base):
+    __tablename__ = "controle_cache"
+
+    # Linha única com um contador incrementado na mesma transação de cada escrita de
+    # pedido; o cache do produto mais vendido de todos os workers compara com ele.
+    # Atenção: toda escrita de pedido atualiza esta mesma linha (ponto único de escrita).
+    # No SQLite as escritas já são serializadas; num banco servidor será a linha mais disputada
+    id = Column(Integer, primary_key=True)
+    geracao = Column(Integer, nullable=False, default=0)
+
+
+event.listen(
+    ControleCache.__table__,
+    "after_create",
+    DDL("INSERT INTO controle_cache (id, geracao) VALUES (1, 0)")
+)
+
+
 # Índices compostos para otimização
 Index('idx_item_pedido_produto', ItemPedido.pedido_id, ItemPedido.produto_id)
-Index('idx_pedido_data_cliente', Pedido.data_pedido, Pedido.cliente)
\ No newline at end of file
+Index('idx_pedido_data_cliente', Pedido.data_pedido, Pedido.cliente)
+Index('idx_produto_estoque', Produto.quantidade_estoque)
\ No newline at end of file
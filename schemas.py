@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import Optional, List
 from datetime import datetime
 
@@ -10,11 +10,13 @@ class ProdutoBase(BaseModel):
     preco: float = Field(..., gt=0, description="Preço unitário do produto")
     quantidade_estoque: int = Field(..., ge=0, description="Quantidade em estoque")
 
-    @validator('nome')
+    @field_validator('nome')
+    @classmethod
     def validar_nome(cls, v):
         return v.strip().title()
 
-    @validator('descricao')
+    @field_validator('descricao')
+    @classmethod
     def validar_descricao(cls, v):
         if v:
             return v.strip()
@@ -24,13 +26,16 @@ class ProdutoCreate(ProdutoBase):
     pass
 
 class ProdutoUpdate(ProdutoBase):
-    pass
+    versao: Optional[int] = Field(
+        None, ge=1,
+        description="Versão lida do produto; se informada e o produto tiver sido alterado desde então, retorna 409"
+    )
 
 class Produto(ProdutoBase):
     id: int
+    versao: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # === PEDIDO ===
 
@@ -46,18 +51,19 @@ class ItemPedidoOut(BaseModel):
     preco_unitario: float
     valor_total_item: float
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PedidoBase(BaseModel):
     cliente: str = Field(..., min_length=1, max_length=100, description="Nome do cliente")
-    itens: List[ItemPedidoCreate] = Field(..., min_items=1, description="Itens do pedido")
+    itens: List[ItemPedidoCreate] = Field(..., min_length=1, description="Itens do pedido")
 
-    @validator('cliente')
+    @field_validator('cliente')
+    @classmethod
     def validar_cliente(cls, v):
         return v.strip().title()
 
-    @validator('itens')
+    @field_validator('itens')
+    @classmethod
     def validar_itens_unicos(cls, v):
         produto_ids = [item.produto_id for item in v]
         if len(produto_ids) != len(set(produto_ids)):
@@ -77,8 +83,16 @@ class Pedido(BaseModel):
     data_pedido: datetime
     itens: List[ItemPedidoOut]
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class PedidoResumo(BaseModel):
+    id: int
+    cliente: str
+    valor_total: float
+    data_pedido: datetime
+    quantidade_itens: int
+
+    model_config = ConfigDict(from_attributes=True)
 
 # === RESPONSES ===
 
@@ -88,6 +102,18 @@ class MensagemResponse(BaseModel):
 class ErroResponse(BaseModel):
     detail: str
 
+class ProdutoMaisVendido(BaseModel):
+    id: int
+    nome: str
+    quantidade_vendida: int
+
+class EstatisticasResponse(BaseModel):
+    total_produtos: int
+    total_pedidos: int
+    valor_total_pedidos: float
+    ticket_medio: float
+    produto_mais_vendido: Optional[ProdutoMaisVendido] = None
+
 # === FILTROS ===
 
 class ProdutoFiltro(BaseModel):